@@ -7,11 +7,47 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
 import streamlit as st
-from pdf_chat_app.src.pdf_processor import process_pdf
+from pdf_chat_app.src.pdf_processor import convert_pdf_to_store, descriptions_up_to_date, ImageDescriptionJob
+from pdf_chat_app.src.document_store import DocumentStore
+from pdf_chat_app.src.summarizer import summarize_document
+from pdf_chat_app.config.config import MAX_DOCUMENT_CHARS
 from pdf_chat_app.components.sidebar import render_sidebar
 from pdf_chat_app.components.pdf_viewer import render_pdf_viewer
 from pdf_chat_app.components.chat_window import render_chat_window
-from pdf_chat_app.src.chat_handler import chat_with_assistant
+from pdf_chat_app.src.chat_handler import chat_with_assistant, update_thread_document
+
+def cancel_image_descriptions():
+    job = st.session_state.pop('image_job', None)
+    if job is not None:
+        job.cancel()
+
+def start_image_descriptions(api_key, user_prompt, context_size):
+    cancel_image_descriptions()
+    st.session_state['image_job'] = ImageDescriptionJob(
+        st.session_state['store_path'], api_key, user_prompt, context_size
+    )
+    st.session_state['descriptions_ready'] = False
+    st.session_state.processing_status = 'describing'
+
+@st.fragment(run_every=2)
+def watch_image_descriptions():
+    # Rerun the whole app once the background job is done so the chat picks up the descriptions
+    job = st.session_state.get('image_job')
+    if job is None or job.done:
+        st.rerun()
+    if job.total:
+        st.caption(f"Describing images in the background ({job.described}/{job.total}). The chat uses the plain text until then.")
+    else:
+        st.caption("Extracting images in the background. The chat uses the plain text until then.")
+
+def load_chat_document(store_path, with_descriptions, api_key, chat_model):
+    # Large documents are replaced by their digest once an API key is available
+    with DocumentStore(store_path) as store:
+        markdown_text = store.assemble_markdown(with_descriptions=with_descriptions)
+        if api_key and len(markdown_text) > MAX_DOCUMENT_CHARS:
+            with st.spinner("The document is too large for the chat, summarizing it..."):
+                return summarize_document(store, api_key, chat_model, with_descriptions), True
+    return markdown_text, False
 
 def main():
     # Set page configuration
@@ -36,8 +72,8 @@ def main():
             - Choose the image processing model to analyze visual elements in the PDF.
             - Provide any specific instructions for image descriptions.
             - Adjust the context size for image processing.
-        - **Process the PDF**: Click the "Process PDF" button. The app will convert the PDF into a format that can be easily queried.
-        - **Interact with the Document**: Once processing is complete, you can ask questions about the document in the chat window.
+        - **Process the PDF**: The text is extracted as soon as you upload the file, and image descriptions are generated in the background. Click the "Process PDF" button to describe the images again with new settings.
+        - **Interact with the Document**: You can ask questions about the text right away. Image descriptions are added to the chat's document once they are ready.
 
         ### Why Image Processing? 🤔
         Image processing enhances the understanding of the document by allowing the AI to analyze visual elements such as diagrams, charts, and images. 
@@ -46,6 +82,21 @@ def main():
         **Get started now and unlock the potential of your PDF documents!** 🚀
         """)
 
+    # Pick up the background image descriptions once they are done
+    job = st.session_state.get('image_job')
+    if job is not None and job.done:
+        del st.session_state['image_job']
+        if job.error:
+            st.session_state['conversion_status'] = {
+                'success': False,
+                'error': job.error
+            }
+            st.session_state.processing_status = 'error'
+        else:
+            st.session_state['conversion_status']['image_count'] = job.described
+            st.session_state['descriptions_ready'] = True
+            st.session_state.processing_status = 'completed'
+
     # Render sidebar and capture selected models
     api_key, user_prompt, process_images, process_button, context_size, use_descriptions, reload_chat, chat_model, image_model = render_sidebar()
 
@@ -57,6 +108,11 @@ def main():
         if uploaded_file:
             st.session_state['current_file'] = uploaded_file
             st.session_state['file_processed'] = False
+            st.session_state['descriptions_ready'] = False
+            st.session_state.processing_status = 'idle'
+            # Stop describing the previous document, it is no longer shown
+            cancel_image_descriptions()
+            st.session_state.pop('markdown_variant', None)
             if 'chat_history' in st.session_state:
                 del st.session_state['chat_history']
 
@@ -71,12 +127,21 @@ def main():
         col1, col2 = st.columns([0.5, 0.5])
 
         with col1:
-            # Process the PDF when the sidebar button is clicked
             if process_button:
-                st.session_state.processing_status = 'processing'
-                st.rerun()
-
-            if st.session_state.processing_status == 'processing':
+                if not st.session_state.get('file_processed', False):
+                    # Retry the text extraction after an error
+                    st.session_state.processing_status = 'idle'
+                elif not process_images:
+                    st.info("Image processing is turned off in the sidebar, so there are no image descriptions to generate.")
+                elif not api_key:
+                    st.warning("Please enter your OpenAI API key in the sidebar to describe the images.")
+                else:
+                    # Restart the descriptions with the current settings, cancelling a running job
+                    start_image_descriptions(api_key, user_prompt, context_size)
+                    st.rerun()
+
+            # Extract the text layer as soon as the file is uploaded, images are described later
+            if not st.session_state.get('file_processed', False) and st.session_state.processing_status != 'error':
                 # Save the uploaded file with its original name
                 save_path = os.path.join("uploads", uploaded_file.name)
                 os.makedirs(os.path.dirname(save_path), exist_ok=True)
@@ -84,26 +149,19 @@ def main():
                     f.write(uploaded_file.getbuffer())
 
                 try:
-                    markdown_text, output_md_path, output_md_with_descriptions_path, image_count = process_pdf(
-                        save_path, api_key, user_prompt, process_images, context_size
-                    )
-                    # Read the content of the file with or without descriptions based on the toggle
-                    if use_descriptions:
-                        with open(output_md_with_descriptions_path, 'r', encoding='utf-8') as f:
-                            markdown_text_to_use = f.read()
-                    else:
-                        with open(output_md_path, 'r', encoding='utf-8') as f:
-                            markdown_text_to_use = f.read()
-                    st.session_state['markdown_text'] = markdown_text_to_use
-                    st.session_state['output_folder'] = os.path.dirname(output_md_path)
+                    with st.spinner("Extracting text from the PDF..."):
+                        store_path = convert_pdf_to_store(save_path)
+                    st.session_state['store_path'] = store_path
+                    st.session_state['output_folder'] = os.path.dirname(store_path)
                     st.session_state['conversion_status'] = {
                         'success': True,
-                        'output_md_path': output_md_path,
-                        'output_md_with_descriptions_path': output_md_with_descriptions_path,
-                        'image_count': image_count
+                        'store_path': store_path,
+                        'image_count': 0
                     }
                     st.session_state['file_processed'] = True
-                    st.session_state.processing_status = 'completed'
+                    if descriptions_up_to_date(store_path, user_prompt, context_size):
+                        # A previous run already described the images with these settings
+                        st.session_state['descriptions_ready'] = True
                 except Exception as e:
                     st.session_state['markdown_text'] = "Error occurred while processing the PDF."
                     st.session_state['conversion_status'] = {
@@ -114,18 +172,47 @@ def main():
                 finally:
                     # Remove the temporary file
                     os.remove(save_path)
-                
+
                 # Force a rerun to update the sidebar
                 st.rerun()
 
             if st.session_state.get('file_processed', False):
-                # Use the appropriate markdown text based on the use_descriptions toggle
-                markdown_text = st.session_state.get('markdown_text', '')
-
-                # Render chat window with the selected chat model
-                render_chat_window(api_key, markdown_text, chat_model)  # Pass chat_model here
+                # Describe the images as soon as possible, including when the API key is entered after the upload
+                if (process_images and api_key and 'image_job' not in st.session_state
+                        and not st.session_state.get('descriptions_ready', False)
+                        and st.session_state.processing_status != 'error'):
+                    start_image_descriptions(api_key, user_prompt, context_size)
+                    # Rerun to show the progress in the sidebar
+                    st.rerun()
+
+                # Use the descriptions only once they are ready, and hot-swap them into the chat
+                with_descriptions = use_descriptions and st.session_state.get('descriptions_ready', False)
+                # Large documents are summarized once an API key is available
+                document_variant = (with_descriptions, bool(api_key), chat_model)
+                if st.session_state.get('markdown_variant') != document_variant:
+                    try:
+                        markdown_text, is_digest = load_chat_document(
+                            st.session_state['store_path'], with_descriptions, api_key, chat_model
+                        )
+                        st.session_state['markdown_text'] = markdown_text
+                        st.session_state['is_digest'] = is_digest
+                        st.session_state['markdown_variant'] = document_variant
+                        if 'chat_history' in st.session_state:
+                            update_thread_document(st.session_state['chat_history'], markdown_text, is_digest)
+                    except Exception as e:
+                        # Never fall back to the oversized full text, the summary is retried on the next run
+                        st.error(f"An error occurred while summarizing the document: {str(e)}")
+
+                if 'image_job' in st.session_state:
+                    watch_image_descriptions()
+
+                if st.session_state.get('markdown_variant') == document_variant:
+                    # Render chat window with the selected chat model
+                    render_chat_window(api_key, st.session_state['markdown_text'], chat_model, st.session_state.get('is_digest', False))  # Pass chat_model here
+                else:
+                    st.info("The chat will be available once the document has been summarized. Interact with the app to retry.")
             else:
-                st.info("Please process the PDF using the button in the sidebar before starting the chat.")
+                st.info("An error occurred while extracting the text. Use the button in the sidebar to try again.")
 
         with col2:
             # Render PDF viewer
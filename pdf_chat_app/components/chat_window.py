@@ -1,14 +1,14 @@
 import streamlit as st
 from pdf_chat_app.src.chat_handler import initialize_thread, chat_with_assistant, stream_string
 
-def render_chat_window(api_key, pdf_content, chat_model):  # Accept chat_model
+def render_chat_window(api_key, pdf_content, chat_model, is_digest=False):  # Accept chat_model
     if not api_key:
         st.warning("Please enter your OpenAI API key in the sidebar to use the chat feature.")
         return
 
     # Initialize chat history
     if 'chat_history' not in st.session_state:
-        st.session_state['chat_history'] = initialize_thread(pdf_content)
+        st.session_state['chat_history'] = initialize_thread(pdf_content, is_digest)
 
     # Create a container for the entire chat interface
     chat_container = st.container()
@@ -44,6 +44,7 @@ def render_sidebar():
 
         st.subheader("3. Process PDF")
         process_button = st.button("Process PDF", use_container_width=True, type="primary")
+        st.caption("Text is extracted on upload. This (re)starts the image descriptions with the settings above.")
         
         # Processing status
         if 'processing_status' not in st.session_state:
@@ -54,6 +55,13 @@ def render_sidebar():
         if st.session_state.processing_status == 'processing':
             status_container.progress(50, "Processing...")
             st.info("PDF is being processed. This may take a moment.")
+        elif st.session_state.processing_status == 'describing':
+            job = st.session_state.get('image_job')
+            if job is not None and job.total:
+                status_container.progress(job.described / job.total, f"Describing images ({job.described}/{job.total})...")
+            else:
+                status_container.progress(0, "Describing images...")
+            st.info("You can already chat about the text. Image descriptions are added once they are ready.")
         elif st.session_state.processing_status == 'completed':
             status_container.progress(100)
             st.success("PDF processed successfully!")
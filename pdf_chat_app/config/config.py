@@ -1,2 +1,10 @@
 # Constants
-CONTEXT_SIZE_WORDS = 100  # Default number of words for context before and after the image
\ No newline at end of file
+CONTEXT_SIZE_WORDS = 100  # Default number of words for context before and after the image
+MAX_DOCUMENT_CHARS = 300000  # Larger documents are replaced by a summarized digest in the chat
+SECTION_PAGES = 20  # Number of consecutive pages summarized in a single call
+SECTION_MAX_CHARS = 300000  # Sections longer than this are split (about 75k tokens)
+SUMMARY_MAX_WORKERS = 16  # Number of summarization calls running in parallel
+SUMMARY_REDUCE_FAN_IN = 10  # Number of partial summaries combined in a single reduce call
+SUMMARY_MAX_TOKENS = 800  # Maximum length of each summary
+SUMMARY_MAX_RETRIES = 5  # Retries of a summarization call after a rate limit or transient error
+SUMMARY_MAX_TOKENS_IN_FLIGHT = 120000  # Estimated tokens of the summarization calls running at once, keep below the per-minute limit
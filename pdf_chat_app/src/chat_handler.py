@@ -1,13 +1,23 @@
 from openai import OpenAI
 import time
 
-def initialize_thread(pdf_content):
+def document_message(pdf_content, is_digest=False):
+    if is_digest:
+        # Documents larger than the model context are replaced by their summarized digest
+        return {"role": "user", "content": f"The PDF document I want to discuss is too long to paste in full. Here's a digest summarizing its content:\n\n{pdf_content}\n\nPlease help me understand and analyze this document based on this digest."}
+    return {"role": "user", "content": f"Here's the content of the PDF document I want to discuss:\n\n{pdf_content}\n\nPlease help me understand and analyze this document."}
+
+def initialize_thread(pdf_content, is_digest=False):
     return [
         {"role": "system", "content": "You are a helpful assistant that answers questions about the following PDF document. Provide accurate and relevant information based on the document's content."},
-        {"role": "user", "content": f"Here's the content of the PDF document I want to discuss:\n\n{pdf_content}\n\nPlease help me understand and analyze this document."},
+        document_message(pdf_content, is_digest),
         {"role": "assistant", "content": "Certainly! I've reviewed the content of the PDF document you provided. I'm ready to answer any questions you have about it, provide summaries, or help you analyze specific parts of the document. What would you like to know?"}
     ]
 
+def update_thread_document(messages, pdf_content, is_digest=False):
+    # Swap in a new version of the document while keeping the conversation
+    messages[1] = document_message(pdf_content, is_digest)
+
 def chat_with_assistant(api_key, messages, user_message, chat_model):  # Accept chat_model
     client = OpenAI(api_key=api_key)
 
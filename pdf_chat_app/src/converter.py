@@ -9,10 +9,9 @@ class PDFConverter:
         self.client = OpenAI(api_key=api_key)
         self.model = model
 
-    def describe_image_and_context(self, image_path, context_before, context_after, user_prompt):
+    def describe_image_and_context(self, image_bytes, context_before, context_after, user_prompt):
         try:
-            with open(image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
+            image_data = base64.b64encode(image_bytes).decode('utf-8')
 
             prompt = f"""
             You are an AI assistant helping to convert documents with images into accessible text formats. 
@@ -0,0 +1,253 @@
+import hashlib
+import os
+import sqlite3
+
+# Each processed PDF is stored as a single SQLite file holding the source PDF,
+# the text chunks of every page (split after each image reference), the line
+# range of each page, the image bytes with their hashes, the image
+# descriptions, the document metadata and the section summaries keyed by
+# content hash.
+# Bump when the schema or the meaning of its columns changes, so artifacts
+# written by an older version are rebuilt instead of reused
+FORMAT_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS source (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    page_number INTEGER PRIMARY KEY,
+    line_offset INTEGER NOT NULL,
+    newline_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    page_number INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    image_index INTEGER,
+    PRIMARY KEY (page_number, seq)
+);
+CREATE TABLE IF NOT EXISTS images (
+    image_index INTEGER PRIMARY KEY,
+    page_number INTEGER NOT NULL,
+    line_number INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    data BLOB NOT NULL,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    content_hash TEXT PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_by_page ON images (page_number);
+CREATE INDEX IF NOT EXISTS pages_by_line ON pages (line_offset);
+"""
+
+IMAGE_COLUMNS = ("image_index", "page_number", "line_number", "filename", "sha256", "description")
+
+
+def is_image_line(line):
+    return line.strip().startswith('![]')
+
+
+def image_filename(line):
+    return line.strip()[4:-1]
+
+
+def describe_chunk(text, description):
+    # Same layout as the image description blocks inserted into the markdown
+    return f"{text}\n\n**Image Description:**\n{description}\n"
+
+
+class DocumentStore:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def is_current(self, source_sha256):
+        """Whether this artifact was completely built from that source by this format version."""
+        metadata = self.get_metadata()
+        return (metadata.get('format_version') == str(FORMAT_VERSION)
+                and metadata.get('source_sha256') == source_sha256)
+
+    @classmethod
+    def create(cls, path):
+        # Start from an empty artifact when a document is processed again
+        if os.path.exists(path):
+            os.remove(path)
+        return cls(path)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # --- Writing -----------------------------------------------------------
+
+    def set_metadata(self, **values):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                [(key, str(value)) for key, value in values.items()]
+            )
+
+    def set_source(self, data):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO source (id, data) VALUES (1, ?)", (data,))
+
+    def set_pages(self, pages, image_folder=None):
+        """Replace the pages, splitting each into chunks that end at image references.
+
+        pages is a list of (page_number, text). Images referenced by the pages
+        are read from image_folder and stored in the artifact; without a folder
+        no images are stored. Everything is replaced in a single transaction.
+        """
+        page_rows = []
+        chunk_rows = []
+        image_rows = []
+        line_offset = 0
+        for page_number, text in pages:
+            current = []
+            seq = 0
+            for line_number, line in enumerate(text.split('\n'), start=line_offset):
+                current.append(line)
+                if image_folder is None or not is_image_line(line):
+                    continue
+                image_path = os.path.join(image_folder, image_filename(line))
+                if not os.path.exists(image_path):
+                    continue
+                with open(image_path, "rb") as image_file:
+                    data = image_file.read()
+                image_index = len(image_rows) + 1
+                image_rows.append((image_index, page_number, line_number, image_filename(line),
+                                   hashlib.sha256(data).hexdigest(), data))
+                chunk_rows.append((page_number, seq, '\n'.join(current), image_index))
+                seq += 1
+                current = []
+            if current:
+                chunk_rows.append((page_number, seq, '\n'.join(current), None))
+            page_rows.append((page_number, line_offset, text.count('\n')))
+            # Pages are concatenated without separator, so the last line of this
+            # page continues on the first line of the next one
+            line_offset += text.count('\n')
+
+        with self.conn:
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.execute("DELETE FROM images")
+            self.conn.execute("DELETE FROM pages")
+            self.conn.executemany(
+                "INSERT INTO pages (page_number, line_offset, newline_count) VALUES (?, ?, ?)", page_rows
+            )
+            self.conn.executemany(
+                "INSERT INTO images (image_index, page_number, line_number, filename, sha256, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                image_rows
+            )
+            self.conn.executemany(
+                "INSERT INTO chunks (page_number, seq, text, image_index) VALUES (?, ?, ?, ?)", chunk_rows
+            )
+        return len(image_rows)
+
+    def set_image_description(self, image_index, description):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE images SET description = ? WHERE image_index = ?",
+                (description, image_index)
+            )
+
+    def set_summaries(self, summaries):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO summaries (content_hash, summary) VALUES (?, ?)",
+                list(summaries.items())
+            )
+
+    # --- Reading -----------------------------------------------------------
+
+    def get_metadata(self):
+        return dict(self.conn.execute("SELECT key, value FROM metadata"))
+
+    def get_source(self):
+        row = self.conn.execute("SELECT data FROM source WHERE id = 1").fetchone()
+        return row[0] if row else None
+
+    def page_numbers(self):
+        return [row[0] for row in self.conn.execute("SELECT page_number FROM pages ORDER BY page_number")]
+
+    def page_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def image_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def get_page(self, page_number, with_descriptions=False):
+        rows = self.conn.execute(
+            "SELECT chunks.text, images.description FROM chunks "
+            "LEFT JOIN images ON images.image_index = chunks.image_index "
+            "WHERE chunks.page_number = ? ORDER BY chunks.seq",
+            (page_number,)
+        ).fetchall()
+        if not rows:
+            return None
+        return '\n'.join(describe_chunk(text, description) if with_descriptions and description else text
+                          for text, description in rows)
+
+    def get_image(self, image_index, include_data=False):
+        columns = IMAGE_COLUMNS + (("data",) if include_data else ())
+        row = self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM images WHERE image_index = ?", (image_index,)
+        ).fetchone()
+        return dict(zip(columns, row)) if row else None
+
+    def get_images(self, page_number=None):
+        query = f"SELECT {', '.join(IMAGE_COLUMNS)} FROM images"
+        params = ()
+        if page_number is not None:
+            query += " WHERE page_number = ?"
+            params = (page_number,)
+        return [dict(zip(IMAGE_COLUMNS, row))
+                for row in self.conn.execute(query + " ORDER BY image_index", params)]
+
+    def get_lines(self, start, end):
+        """Return lines start to end (exclusive) of the markdown without descriptions.
+
+        Only the pages covering that line range are read.
+        """
+        start = max(start, 0)
+        rows = self.conn.execute(
+            "SELECT page_number, line_offset FROM pages "
+            "WHERE line_offset < ? AND line_offset + newline_count >= ? ORDER BY page_number",
+            (end, start)
+        ).fetchall()
+        if not rows:
+            return []
+        text = ''.join(self.get_page(page_number) for page_number, _ in rows)
+        first_line = rows[0][1]
+        return text.split('\n')[start - first_line:end - first_line]
+
+    def assemble_markdown(self, with_descriptions=False, page_numbers=None):
+        """Rebuild the document markdown, optionally with the image descriptions inserted."""
+        if page_numbers is None:
+            page_numbers = self.page_numbers()
+        return ''.join(self.get_page(page_number, with_descriptions) or '' for page_number in page_numbers)
+
+    def get_summaries(self, content_hashes):
+        summaries = {}
+        for content_hash in content_hashes:
+            row = self.conn.execute(
+                "SELECT summary FROM summaries WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row:
+                summaries[content_hash] = row[0]
+        return summaries
@@ -1,94 +1,198 @@
 import os
+import hashlib
 import logging
 import pymupdf4llm
 import fitz  # PyMuPDF
 import shutil
+import tempfile
+import threading
 from pdf_chat_app.src.converter import PDFConverter
+from pdf_chat_app.src.document_store import DocumentStore, FORMAT_VERSION
 from pdf_chat_app.config.config import CONTEXT_SIZE_WORDS
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def process_pdf(pdf_path, api_key, user_prompt, process_images=True, context_size=CONTEXT_SIZE_WORDS):
+def convert_pdf_to_store(pdf_path):
     logging.info(f"Starting conversion of PDF: {pdf_path}")
     base_name = os.path.splitext(os.path.basename(pdf_path))[0]
     script_dir = os.path.dirname(os.path.abspath(__file__))
     pdf_output_folder = os.path.join(script_dir, "..", "pdf_output")
     output_folder = os.path.join(pdf_output_folder, base_name)
     os.makedirs(output_folder, exist_ok=True)
-    output_md_path = os.path.join(output_folder, f"{base_name}.md")
-    
+
+    with open(pdf_path, "rb") as pdf_file:
+        source_data = pdf_file.read()
+    source_sha256 = hashlib.sha256(source_data).hexdigest()
+    # Each version of the PDF gets its own artifact, so a store is never
+    # recreated under a background job still holding it open
+    store_path = os.path.join(output_folder, f"{base_name}-{source_sha256[:16]}.sqlite")
+    for file in os.listdir(output_folder):
+        if file.endswith(".sqlite") and file != os.path.basename(store_path):
+            try:
+                os.remove(os.path.join(output_folder, file))
+            except OSError as e:
+                logging.warning(f"Could not remove outdated document store {file}: {e}")
+    if os.path.exists(store_path):
+        with DocumentStore(store_path) as store:
+            if store.is_current(source_sha256):
+                logging.info(f"Reusing document store: {store_path}")
+                return store_path
+
     try:
-        logging.info("Converting PDF to Markdown")
-        markdown_text = pymupdf4llm.to_markdown(pdf_path, write_images=True)
-        
-        logging.info("Moving generated images")
-        for file in os.listdir():
-            if file.endswith(".png") and file.startswith(base_name):
-                src_path = os.path.join(os.getcwd(), file)
-                dst_path = os.path.join(output_folder, file)
-                shutil.move(src_path, dst_path)
-                logging.info(f"Moved image: {src_path} -> {dst_path}")
-        
-        with open(output_md_path, "w", encoding="utf-8") as f:
-            f.write(markdown_text)
-        
-        logging.info(f"Initial Markdown file saved to: {output_md_path}")
-        
+        # Only the text layer is converted here, rendering the images is left
+        # to extract_images in the background job
+        logging.info("Converting PDF text to Markdown")
+        page_chunks = pymupdf4llm.to_markdown(pdf_path, page_chunks=True)
+
+        with DocumentStore.create(store_path) as store:
+            store.set_source(source_data)
+            store.set_pages([(page["metadata"]["page"], page["text"]) for page in page_chunks])
+            # The source hash is written last, so only complete artifacts are reused
+            store.set_metadata(source=os.path.basename(pdf_path), page_count=store.page_count(),
+                               image_count=0, images_extracted=0, format_version=FORMAT_VERSION,
+                               source_sha256=source_sha256)
+
+        logging.info(f"Document store saved to: {store_path}")
+
     except Exception as e:
         logging.error(f"Error during PDF to Markdown conversion: {e}")
         raise
 
+    return store_path
+
+
+def is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+
+def extract_images(store_path, cancel_event=None):
+    """Render the images of the stored source PDF and store them with their pages.
+
+    The pages are converted again with image references and replace the
+    text-only pages of convert_pdf_to_store. Returns the number of images.
+    """
+    logging.info("Extracting images")
+    with DocumentStore(store_path) as store:
+        source_name = store.get_metadata()['source']
+        base_name = os.path.splitext(source_name)[0]
+        work_folder = tempfile.mkdtemp(dir=os.path.dirname(store_path))
+        try:
+            pdf_path = os.path.join(work_folder, source_name)
+            with open(pdf_path, "wb") as pdf_file:
+                pdf_file.write(store.get_source())
+            page_chunks = pymupdf4llm.to_markdown(pdf_path, write_images=True, page_chunks=True)
+
+            logging.info("Moving generated images")
+            for file in os.listdir():
+                if file.endswith(".png") and file.startswith(base_name):
+                    shutil.move(os.path.join(os.getcwd(), file), os.path.join(work_folder, file))
+
+            if is_cancelled(cancel_event):
+                logging.info("Image extraction cancelled")
+                return 0
+            image_count = store.set_pages([(page["metadata"]["page"], page["text"]) for page in page_chunks],
+                                          work_folder)
+            store.set_metadata(image_count=image_count, images_extracted=1)
+        finally:
+            # The images now live in the document store
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    logging.info(f"Total images extracted: {image_count}")
+    return image_count
+
+
+def describe_images(store_path, api_key, user_prompt, context_size=CONTEXT_SIZE_WORDS, progress_callback=None,
+                    cancel_event=None):
+    logging.info("Processing images")
+    converter = PDFConverter(api_key)
     image_count = 0
-    if process_images:
-        logging.info("Processing images")
-        converter = PDFConverter(api_key)
-        lines = markdown_text.split('\n')
-        new_lines = []
-        context_before = []
-
-        for line in lines:
-            new_lines.append(line)
-            if line.strip().startswith('![]'):
-                image_filename = line.strip()[4:-1]
-                image_path = os.path.join(output_folder, image_filename)
-                
-                if os.path.exists(image_path):
-                    logging.info(f"Processing image: {image_path}")
-                    context_before_text = '\n'.join(context_before[-context_size:])
-                    context_after_index = lines.index(line) + 1
-                    context_after_text = '\n'.join(lines[context_after_index:context_after_index+context_size])
-                    
-                    description = converter.describe_image_and_context(image_path, context_before_text, context_after_text, user_prompt)
-                    
-                    new_lines.extend(['', '**Image Description:**', description, ''])
-                    
-                    image_count += 1
-                    description_filename = f"image_description_{image_count}.txt"
-                    description_path = os.path.join(output_folder, description_filename)
-                    with open(description_path, "w", encoding="utf-8") as desc_file:
-                        desc_file.write(f"Context before:\n{context_before_text}\n\n")
-                        desc_file.write(f"Context after:\n{context_after_text}\n\n")
-                        desc_file.write(f"Image Description:\n{description}\n")
-                    
-                    logging.info(f"Saved image description to: {description_path}")
-                else:
-                    logging.warning(f"Image file not found: {image_path}")
-            
-            context_before.append(line)
-            if len(context_before) > context_size * 2:
-                context_before.pop(0)
-
-        markdown_text_with_descriptions = '\n'.join(new_lines)
-        
-        output_md_with_descriptions_path = os.path.join(output_folder, f"{base_name}_with_descriptions.md")
-        with open(output_md_with_descriptions_path, "w", encoding="utf-8") as f:
-            f.write(markdown_text_with_descriptions)
-        
-        logging.info(f"Markdown file with descriptions saved to: {output_md_with_descriptions_path}")
-        logging.info(f"Total images processed: {image_count}") 
-        
-        return markdown_text, output_md_path, output_md_with_descriptions_path, image_count
-    else:
-        logging.info("Image processing skipped.")
-        return markdown_text, output_md_path, None, 0
\ No newline at end of file
+    with DocumentStore(store_path) as store:
+        # A cancelled job never writes again, the store may be in use by a newer one
+        if is_cancelled(cancel_event):
+            return 0
+        # Mark the descriptions as incomplete until the run finishes
+        store.set_metadata(described_images=0)
+        images = store.get_images()
+        for image in images:
+            if is_cancelled(cancel_event):
+                logging.info(f"Image processing cancelled after {image_count} images")
+                return image_count
+            logging.info(f"Processing image: {image['filename']} (page {image['page_number']})")
+            # The context is read from the pages around the image only
+            line_number = image['line_number']
+            context_before_text = '\n'.join(store.get_lines(line_number - context_size, line_number))
+            context_after_text = '\n'.join(store.get_lines(line_number + 1, line_number + 1 + context_size))
+
+            image_data = store.get_image(image['image_index'], include_data=True)['data']
+            description = converter.describe_image_and_context(image_data, context_before_text, context_after_text, user_prompt)
+            if is_cancelled(cancel_event):
+                logging.info(f"Image processing cancelled after {image_count} images")
+                return image_count
+            store.set_image_description(image['image_index'], description)
+            image_count += 1
+            if progress_callback:
+                progress_callback(image_count, len(images))
+
+        if is_cancelled(cancel_event):
+            return image_count
+        store.set_metadata(context_size=context_size, user_prompt=user_prompt, described_images=image_count)
+
+    logging.info(f"Total images processed: {image_count}")
+    return image_count
+
+
+def descriptions_up_to_date(store_path, user_prompt, context_size=CONTEXT_SIZE_WORDS):
+    with DocumentStore(store_path) as store:
+        metadata = store.get_metadata()
+    return (metadata.get('images_extracted') == '1'
+            and metadata.get('described_images') == metadata.get('image_count')
+            and metadata.get('context_size') == str(context_size)
+            and metadata.get('user_prompt') == user_prompt)
+
+
+class ImageDescriptionJob:
+    """Describes the images of a document store in a background thread.
+
+    Streamlit reruns poll `done` and read the descriptions from the store once
+    the job has finished, so the chat can start on the plain text meanwhile.
+    """
+
+    def __init__(self, store_path, api_key, user_prompt, context_size=CONTEXT_SIZE_WORDS):
+        self.store_path = store_path
+        self.described = 0
+        self.total = 0
+        self.error = None
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(api_key, user_prompt, context_size), daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+
+    def cancel(self):
+        # Returns right away, the thread stops before its next write to the store
+        self._cancel_event.set()
+
+    def _run(self, api_key, user_prompt, context_size):
+        try:
+            with DocumentStore(self.store_path) as store:
+                images_extracted = store.get_metadata().get('images_extracted') == '1'
+            if not images_extracted:
+                extract_images(self.store_path, self._cancel_event)
+                if is_cancelled(self._cancel_event):
+                    return
+            with DocumentStore(self.store_path) as store:
+                self.total = store.image_count()
+            describe_images(self.store_path, api_key, user_prompt, context_size, self._on_progress,
+                            self._cancel_event)
+        except Exception as e:
+            logging.error(f"Error during image description: {e}")
+            self.error = str(e)
+
+    def _on_progress(self, described, total):
+        self.described = described
+        self.total = total
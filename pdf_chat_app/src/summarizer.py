@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import openai
+from openai import OpenAI
+from pdf_chat_app.config.config import (
+    SECTION_PAGES,
+    SECTION_MAX_CHARS,
+    SUMMARY_MAX_WORKERS,
+    SUMMARY_REDUCE_FAN_IN,
+    SUMMARY_MAX_TOKENS,
+    SUMMARY_MAX_RETRIES,
+    SUMMARY_MAX_TOKENS_IN_FLIGHT,
+)
+
+SECTION_PROMPT = """Summarize the following section of a PDF document. Keep the key facts, figures, names and conclusions, and mention the headings it covers so the summary can be used to answer questions about the document.
+
+Section:
+{text}"""
+
+REDUCE_PROMPT = """The following are summaries of consecutive parts of a PDF document. Combine them into a single summary that keeps the overall structure of the document and its key facts, figures, names and conclusions.
+
+Summaries:
+{text}"""
+
+# Rate limits and transient failures are retried with exponential backoff
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+def split_sections(store, with_descriptions=False, pages_per_section=SECTION_PAGES, max_chars=SECTION_MAX_CHARS):
+    """Split the stored document into sections of pages_per_section consecutive pages.
+
+    The boundaries only depend on the page numbers, so adding an image
+    description changes the section of its page and no other. Sections longer
+    than max_chars are hard-wrapped.
+    """
+    page_numbers = store.page_numbers()
+    sections = []
+    for i in range(0, len(page_numbers), pages_per_section):
+        section_pages = page_numbers[i:i + pages_per_section]
+        text = store.assemble_markdown(with_descriptions, section_pages)
+        header = f"Pages {section_pages[0]}-{section_pages[-1]}:\n"
+        sections.extend(header + text[j:j + max_chars] for j in range(0, len(text), max_chars))
+    return sections
+
+
+def summary_hash(chat_model, prompt, text):
+    return hashlib.sha256(f"{chat_model}\n{prompt}\n{text}".encode('utf-8')).hexdigest()
+
+
+class TokenBudget:
+    """Limits the estimated tokens of the summarization calls in flight.
+
+    Per-minute token limits are hit long before the worker count is reached
+    with large sections, so each call waits until its tokens fit the budget.
+    """
+
+    def __init__(self, tokens):
+        self.limit = tokens
+        self.available = tokens
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens):
+        # A single call larger than the budget still runs, alone
+        tokens = min(tokens, self.limit)
+        with self._condition:
+            self._condition.wait_for(lambda: self.available >= tokens)
+            self.available -= tokens
+        return tokens
+
+    def release(self, tokens):
+        with self._condition:
+            self.available += tokens
+            self._condition.notify_all()
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + SUMMARY_MAX_TOKENS
+
+
+def retry_delay(error, attempt):
+    # Honour the delay requested by the API, otherwise back off exponentially
+    response = getattr(error, 'response', None)
+    headers = response.headers if response is not None else {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return 2 ** attempt + random.random()
+
+
+def summarize_text(client, chat_model, prompt, text, budget, max_retries=SUMMARY_MAX_RETRIES):
+    """Summarize text, returning None when the model gives no summary (refusal or content filter)."""
+    content = prompt.format(text=text)
+    for attempt in range(max_retries + 1):
+        tokens = budget.acquire(estimate_tokens(content))
+        error = None
+        try:
+            response = client.chat.completions.create(
+                model=chat_model,
+                messages=[{"role": "user", "content": content}],
+                temperature=0.3,
+                max_tokens=SUMMARY_MAX_TOKENS
+            )
+        except RETRYABLE_ERRORS as e:
+            error = e
+        finally:
+            # Free the budget before waiting, so other calls can run meanwhile
+            budget.release(tokens)
+        if error is None:
+            break
+        if attempt == max_retries:
+            raise error
+        delay = retry_delay(error, attempt)
+        logging.warning(f"Summarization call failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    choice = response.choices[0]
+    if choice.message.content is None:
+        logging.warning(f"No summary returned (finish reason: {choice.finish_reason})")
+    return choice.message.content
+
+
+def summarize_all(client, chat_model, prompt, texts, store=None, max_workers=SUMMARY_MAX_WORKERS,
+                  budget=None):
+    # Summaries are cached in the document store by content hash, so only new
+    # or changed texts are sent to the model
+    if budget is None:
+        budget = TokenBudget(SUMMARY_MAX_TOKENS_IN_FLIGHT)
+    hashes = [summary_hash(chat_model, prompt, text) for text in texts]
+    summaries = store.get_summaries(hashes) if store else {}
+    missing = {content_hash: text for content_hash, text in zip(hashes, texts) if content_hash not in summaries}
+    logging.info(f"Summarizing {len(missing)} of {len(texts)} texts ({len(texts) - len(missing)} cached)")
+
+    # Each summary is cached as soon as it arrives, so a failed call does not
+    # lose the ones that already finished
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(summarize_text, client, chat_model, prompt, text, budget): content_hash
+                   for content_hash, text in missing.items()}
+        for future in as_completed(futures):
+            content_hash = futures[future]
+            try:
+                summary = future.result()
+                if summary is None:
+                    # Keep the digest going without caching, the text is tried again next time
+                    summaries[content_hash] = "[This part of the document could not be summarized.]"
+                    continue
+                summaries[content_hash] = summary
+                if store:
+                    store.set_summaries({content_hash: summary})
+            except Exception as e:
+                logging.error(f"Error during summarization: {e}")
+                errors.append(e)
+
+    if errors:
+        raise errors[0]
+    return [summaries[content_hash] for content_hash in hashes]
+
+
+def summarize_document(store, api_key, chat_model, with_descriptions=False,
+                       max_workers=SUMMARY_MAX_WORKERS, fan_in=SUMMARY_REDUCE_FAN_IN):
+    """Build a digest of a stored document too large to send to the model in one message.
+
+    The sections are summarized concurrently, then the partial summaries are
+    combined fan_in at a time until a single digest remains.
+    """
+    # The retries are handled by summarize_text, not stacked on the client's own
+    client = OpenAI(api_key=api_key, max_retries=0)
+    budget = TokenBudget(SUMMARY_MAX_TOKENS_IN_FLIGHT)
+    sections = split_sections(store, with_descriptions)
+    logging.info(f"Summarizing document in {len(sections)} sections")
+    summaries = summarize_all(client, chat_model, SECTION_PROMPT, sections, store, max_workers, budget)
+
+    while len(summaries) > 1:
+        groups = ['\n\n'.join(summaries[i:i + fan_in]) for i in range(0, len(summaries), fan_in)]
+        logging.info(f"Reducing {len(summaries)} summaries into {len(groups)}")
+        summaries = summarize_all(client, chat_model, REDUCE_PROMPT, groups, store, max_workers, budget)
+
+    return summaries[0] if summaries else ''
@@ -5,7 +5,7 @@ setup(
     version="0.1",
     packages=find_packages(),
     install_requires=[
-        'streamlit',
+        'streamlit>=1.37',  # st.fragment(run_every=...)
         'pymupdf4llm',
         'openai',
         'python-dotenv',  # if you decide to use environment variables